@@ -1,20 +1,60 @@
 import os
-from flask import Flask, request, jsonify
-import base64
+import logging
+import uuid
+import orjson
+from flask import Flask, Response, request
+import pybase64
 import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (before detector.py reads its
+# settings and loads the model at import time)
+load_dotenv()
+
+# Configure logging (LOGLEVEL=DEBUG enables per-person blur details)
+logging.basicConfig(
+    level=os.environ.get('LOGLEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+
 from face_module import blur_heads
 from detector import process_image_multi_detector
-from dotenv import load_dotenv
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
-
 # Retrieve secret key from environment variables
 SECRET_KEY = os.environ.get('APP_SECRET_KEY')
 
+def json_response(payload, status=200):
+    """Serialize a response payload with orjson (SIMD JSON, numpy-aware)"""
+    body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(body, status=status, mimetype='application/json')
+
+def multipart_response(metadata, image_bytes):
+    """Build a multipart/form-data response with a JSON part and an optional raw JPEG part"""
+    boundary = uuid.uuid4().hex
+    delimiter = f'--{boundary}\r\n'.encode()
+
+    parts = [
+        delimiter,
+        b'Content-Disposition: form-data; name="metadata"\r\n',
+        b'Content-Type: application/json\r\n\r\n',
+        orjson.dumps(metadata, option=orjson.OPT_SERIALIZE_NUMPY),
+        b'\r\n',
+    ]
+    if image_bytes is not None:
+        parts += [
+            delimiter,
+            b'Content-Disposition: form-data; name="blured_image"; filename="blured_image.jpg"\r\n',
+            b'Content-Type: image/jpeg\r\n\r\n',
+            image_bytes,
+            b'\r\n',
+        ]
+    parts.append(f'--{boundary}--\r\n'.encode())
+
+    return Response(b''.join(parts), content_type=f'multipart/form-data; boundary={boundary}')
+
 @app.route("/")
 def init_connect():
     return "Endpoint reachable"
@@ -24,32 +64,43 @@ def detect():
     # Validate secret key
     provided_secret_key = request.headers.get('secret-key')
     if not provided_secret_key or provided_secret_key != SECRET_KEY:
-        return jsonify({"status": "error", "message": "Unauthorized access"}), 401
+        return json_response({"status": "error", "message": "Unauthorized access"}, 401)
 
     # Get headers
     blur_faces = request.headers.get('blur-faces')
     detect_objects = request.headers.get('detect-objects')
     blur_mode = request.headers.get('blur-mode', 'standard')  # 'standard' or 'fast'
 
+    # Clients accepting multipart/form-data get the blurred image as raw JPEG bytes
+    binary_response = 'multipart/form-data' in request.headers.get('Accept', '')
+
     # Check for active services
     if not blur_faces and not detect_objects:
-        return jsonify({"status": "success", "system_message": "Please include headers 'blur_faces' and 'detect_objects' with a true or false value."})
+        return json_response({"status": "success", "system_message": "Please include headers 'blur_faces' and 'detect_objects' with a true or false value."})
 
     if blur_faces == "false" and detect_objects == "false":
-        return jsonify({"status": "success", "system_message": "Please assign a 'true' value to one or both of the headers: 'blur_faces', 'detect_objects'."})
-
-    # Access JSON data from the request
-    request_data = request.get_json()
-    base64_image_string = request_data.get('image', '')
-
-    # Decode the base64 image string
-    image_data = base64.b64decode(base64_image_string)
+        return json_response({"status": "success", "system_message": "Please assign a 'true' value to one or both of the headers: 'blur_faces', 'detect_objects'."})
+
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        # Raw binary upload: no JSON parsing or base64 decoding needed
+        image_data = request.get_data(cache=False)
+    elif request.mimetype == 'multipart/form-data':
+        # Form upload: raw bytes in the 'image' file field
+        upload = request.files.get('image')
+        image_data = upload.read() if upload else b''
+    else:
+        # Access JSON data from the request
+        request_data = request.get_json()
+        base64_image_string = request_data.get('image', '')
+
+        # Decode the base64 image string (SIMD-accelerated decoder)
+        image_data = pybase64.b64decode(base64_image_string, validate=False)
 
     # Convert binary image data to a numpy array
     numpy_image = np.frombuffer(image_data, np.uint8)
 
     # Process image based on headers
-    detection_data, original_size = process_image_multi_detector(numpy_image)
+    detection_data, original_size, image = process_image_multi_detector(numpy_image)
 
     # Initialize response
     response = {"status": "success"}
@@ -60,21 +111,22 @@ def detect():
 
         if person_coordinates:
             # Use new face_module with MediaPipe Pose-based head detection
-            blurred_image_base64 = blur_heads(
+            blurred_image = blur_heads(
                 person_coordinates,
-                './image.jpg',
+                image,
                 original_size,
-                mode=blur_mode
+                mode=blur_mode,
+                encoding='jpeg' if binary_response else 'base64'
             )
 
             # Send response based on headers values. Blurred image could be None value.
             if detect_objects == 'true':
                 response.update({
                     "coordinates_data": detection_data,
-                    "blured_image": blurred_image_base64
+                    "blured_image": blurred_image
                 })
             else:
-                response["blured_image"] = blurred_image_base64
+                response["blured_image"] = blurred_image
         else:
             # If there were no people detected, no blurring needed
             if detect_objects == 'true':
@@ -89,7 +141,10 @@ def detect():
     elif detect_objects == 'true':
         response["coordinates_data"] = detection_data
 
-    return jsonify(response)
+    if binary_response:
+        return multipart_response(response, response.pop("blured_image", None))
+
+    return json_response(response)
 
 if __name__ == "__main__":
     #app.run(host="0.0.0.0", port=5000)
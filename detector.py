@@ -1,9 +1,15 @@
 import cv2
+import logging
 import numpy as np
 import os
+import queue
 import sys
+import threading
+import time
 import torch
 import torch.nn.functional as F
+from collections import deque
+from concurrent.futures import Future
 
 # Add yolov7_model directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'yolov7_model'))
@@ -11,13 +17,107 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'yolov7_model'))
 # Import YOLOv7 modules
 from yolov7_model.models.experimental import attempt_load
 from yolov7_model.utils.general import non_max_suppression, scale_coords, check_img_size
-from yolov7_model.utils.datasets import letterbox
 from yolov7_model.utils.torch_utils import select_device
 
+logger = logging.getLogger(__name__)
+
+def fast_letterbox(img, new_shape=1280, color=(114, 114, 114)):
+    """Resize and pad an image to a square ``new_shape`` while preserving aspect ratio.
+
+    Equivalent to YOLOv7's ``letterbox(img, new_shape, auto=False)`` (same
+    scale, rounding and padding split, so ``scale_coords`` still applies) but
+    done with one ``cv2.resize`` and one ``cv2.copyMakeBorder`` and without
+    computing the ratio/padding tuples nobody uses.
+    """
+    h, w = img.shape[:2]
+    r = min(new_shape / h, new_shape / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    dw = (new_shape - new_w) / 2
+    dh = (new_shape - new_h) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+
+    return cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+
+
+# TensorRT is optional: only available on GPU deployments with an exported engine
+try:
+    import tensorrt as trt
+except ImportError:
+    trt = None
+
+
+class TensorRTModel:
+    """Runs a serialized TensorRT engine built by export_trt.py.
+
+    Input and output device buffers are allocated once for the largest batch
+    the engine supports and reused for every call; execution is enqueued on a
+    dedicated CUDA stream. Uses the name-based tensor API (TensorRT >= 8.5,
+    including 10.x).
+    """
+
+    def __init__(self, engine_path, device, max_batch=8):
+        self.device = device
+
+        trt_logger = trt.Logger(trt.Logger.WARNING)
+        with open(engine_path, 'rb') as f, trt.Runtime(trt_logger) as runtime:
+            self.engine = runtime.deserialize_cuda_engine(f.read())
+        self.context = self.engine.create_execution_context()
+        self.stream = torch.cuda.Stream(device=device)
+
+        self.input_name = 'images'
+        self.output_name = 'output'
+
+        # Engine input is [batch, 3, H, W] with a dynamic batch axis
+        _, _, self.img_h, self.img_w = self.engine.get_tensor_shape(self.input_name)
+        profile_max_batch = self.engine.get_tensor_profile_shape(self.input_name, 0)[2][0]
+        self.max_batch = min(max_batch, profile_max_batch)
+
+        # Allocate buffers at the maximum batch size; smaller batches use a prefix
+        self.context.set_input_shape(self.input_name, (self.max_batch, 3, self.img_h, self.img_w))
+        self.inputs = torch.empty(tuple(self.context.get_tensor_shape(self.input_name)),
+                                  dtype=self._tensor_dtype(self.input_name), device=device)
+        self.outputs = torch.empty(tuple(self.context.get_tensor_shape(self.output_name)),
+                                   dtype=self._tensor_dtype(self.output_name), device=device)
+
+        self.context.set_tensor_address(self.input_name, self.inputs.data_ptr())
+        self.context.set_tensor_address(self.output_name, self.outputs.data_ptr())
+
+    def _tensor_dtype(self, name):
+        """Map a TensorRT tensor dtype to the matching torch dtype"""
+        np_dtype = trt.nptype(self.engine.get_tensor_dtype(name))
+        return torch.from_numpy(np.empty(0, dtype=np_dtype)).dtype
+
+    def __call__(self, img_batch):
+        """Run the engine on a [N, 3, H, W] batch and return the raw predictions"""
+        outputs = []
+        current_stream = torch.cuda.current_stream(self.device)
+
+        with torch.cuda.stream(self.stream):
+            # Make sure the input batch is fully written before the engine reads it
+            self.stream.wait_stream(current_stream)
+
+            for start in range(0, img_batch.shape[0], self.max_batch):
+                chunk = img_batch[start:start + self.max_batch]
+                n = chunk.shape[0]
+
+                self.inputs[:n].copy_(chunk)
+                self.context.set_input_shape(self.input_name, (n, 3, self.img_h, self.img_w))
+                self.context.execute_async_v3(self.stream.cuda_stream)
+                outputs.append(self.outputs[:n].float().clone())
+
+        current_stream.wait_stream(self.stream)
+        return torch.cat(outputs)
+
+
 class ConstructionVehicleDetector:
     """YOLOv7-E6 Construction Vehicle Detector for API"""
     
-    def __init__(self, model_path="yolov7_model/best.pt", device='cpu', img_size=1280, conf_thres=0.25, iou_thres=0.45):
+    def __init__(self, model_path="yolov7_model/best.pt", device='cpu', img_size=1280, conf_thres=0.25, iou_thres=0.45, max_batch=8):
         """Initialize the detector"""
         try:
             self.device = select_device(device)
@@ -36,112 +136,351 @@ class ConstructionVehicleDetector:
             3: 'trailer',
             4: 'vehicle'  # Changed from 'car' to 'vehicle' to match original API
         }
+
+        # Per-class minimum confidence, indexed by class id (low-confidence "person"
+        # detections are dropped); ids missing from class_names never pass
+        self.class_min_conf = torch.full((max(self.class_names) + 1,), float('inf'), device=self.device)
+        for cls_id, class_name in self.class_names.items():
+            self.class_min_conf[cls_id] = 0.40 if class_name == 'person' else 0.0
         
-        # Load model
+        # Half precision on CUDA (the TensorRT engine handles precision itself)
+        self.half = False
+
+        # Load model (TensorRT FP16 engine when available, PyTorch checkpoint otherwise)
         self.model = None
+        self.trt_model = None
         try:
             model_full_path = os.path.join(os.path.dirname(__file__), model_path)
-            print(f"Loading model from: {model_full_path}")
-            self.model = attempt_load(model_full_path, map_location=self.device)
-            self.model.eval()
-            
-            # Check image size
-            self.img_size = check_img_size(self.img_size, s=self.model.stride.max())
-            print(f"Model loaded successfully on {self.device}")
+            engine_path = os.path.splitext(model_full_path)[0] + '.engine'
+
+            if trt is not None and self.device.type == 'cuda' and os.path.exists(engine_path):
+                logger.info("Loading TensorRT engine from: %s", engine_path)
+                try:
+                    self.trt_model = TensorRTModel(engine_path, self.device, max_batch=max_batch)
+
+                    # Input size is fixed when the engine is built
+                    self.img_size = self.trt_model.img_w
+                except Exception as e:
+                    # Incompatible TensorRT version or engine: serve with the PyTorch weights
+                    logger.warning("Could not load TensorRT engine (%s), falling back to PyTorch model", e)
+                    self.trt_model = None
+
+            if self.trt_model is None:
+                logger.info("Loading model from: %s", model_full_path)
+                self.model = attempt_load(model_full_path, map_location=self.device)
+                self.model.eval()
+
+                # Check image size
+                self.img_size = check_img_size(self.img_size, s=self.model.stride.max())
+
+                if self.device.type == 'cuda':
+                    self.half = True
+                    self.model.half()
+            logger.info("Model loaded successfully on %s", self.device)
         except Exception as e:
-            print(f"Error loading model: {e}")
+            logger.error("Error loading model: %s", e)
             raise e
+
+        if self.device.type == 'cuda':
+            # Let cuDNN pick the fastest kernels for the fixed input size
+            torch.backends.cudnn.benchmark = True
+
+        self.warmup()
+
+    def warmup(self, iterations=2):
+        """Run dummy forward passes so the first request does not pay kernel selection/JIT costs"""
+        dummy = torch.zeros((1, 3, self.img_size, self.img_size), dtype=torch.uint8, device=self.device)
+        for _ in range(iterations):
+            self.infer(self.normalize(dummy))
+        logger.info("Detector warmed up (%d passes)", iterations)
     
+    def letterbox_into(self, image, out):
+        """Letterbox a BGR image and write it into ``out`` as an RGB CHW uint8 array"""
+        # Apply letterbox preprocessing (preserves aspect ratio with padding)
+        img = fast_letterbox(image, self.img_size)
+
+        # BGR to RGB in place on the fresh letterboxed buffer, then HWC to CHW
+        # straight into the destination buffer
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+        out[...] = img.transpose(2, 0, 1)
+        return out
+
+    @property
+    def input_dtype(self):
+        """Floating point dtype the model expects as input"""
+        return torch.float16 if self.half else torch.float32
+
+    def normalize(self, img_batch, out=None):
+        """Convert a uint8 [N, 3, H, W] batch already on the device to model input.
+
+        When ``out`` (a preallocated tensor of the same shape and ``input_dtype``)
+        is given, the batch is converted and scaled in place into it instead of
+        allocating new tensors.
+        """
+        if out is None:
+            img_batch = img_batch.to(self.input_dtype)
+            return img_batch / 255.0  # Normalize to 0-1
+
+        out.copy_(img_batch)
+        return out.div_(255.0)
+
     def preprocess_image(self, image):
         """Preprocess image for inference"""
-        # Apply letterbox preprocessing (preserves aspect ratio with padding)
-        img = letterbox(image, self.img_size, stride=32, auto=False)[0]
-        
-        # Convert BGR to RGB and normalize
-        img = img[:, :, ::-1].transpose(2, 0, 1)  # BGR to RGB, HWC to CHW
-        img = np.ascontiguousarray(img)
+        img = np.empty((3, self.img_size, self.img_size), dtype=np.uint8)
+        img = self.letterbox_into(image, img)
         img = torch.from_numpy(img).to(self.device)
-        img = img.float() / 255.0  # Normalize to 0-1
-        
-        if img.ndimension() == 3:
-            img = img.unsqueeze(0)  # Add batch dimension
-        
-        return img
-    
+        img = self.normalize(img)
+
+        return img.unsqueeze(0)  # Add batch dimension
+
+    def infer(self, img_batch):
+        """Run a forward pass on a [N, 3, H, W] batch and return per-image NMS detections"""
+        with torch.no_grad():
+            if self.trt_model is not None:
+                pred = self.trt_model(img_batch)
+            else:
+                pred = self.model(img_batch)[0]
+
+            # Apply NMS (returns one detections tensor per image in the batch)
+            pred = non_max_suppression(pred, self.conf_thres, self.iou_thres,
+                                     classes=None, agnostic=False)
+        return pred
+
+    def postprocess(self, detections, input_shape, image_shape):
+        """Convert NMS detections of a single image into the original API format"""
+        if detections is None or not len(detections):
+            return {}
+
+        # Filter unknown classes and per-class low confidence in one shot on the device
+        cls = detections[:, 5].long()
+        known = (cls >= 0) & (cls < len(self.class_min_conf))
+        detections, cls = detections[known], cls[known]
+        detections = detections[detections[:, 4] >= self.class_min_conf[cls]].float()
+        if not len(detections):
+            return {}
+
+        # Scale coordinates back to original image size, then a single device-to-host copy
+        detections[:, :4] = scale_coords(input_shape, detections[:, :4], image_shape).round()
+        detections = detections.cpu().numpy()
+
+        # Format as [x, y, w, h] to match original API
+        boxes = detections[:, :4].astype(np.int32)
+        boxes[:, 2:] -= boxes[:, :2]
+        confidences = detections[:, 4]
+
+        # Group by class, preserving NMS order within each class
+        result_dict = {}
+        class_ids, inverse = np.unique(detections[:, 5].astype(np.int64), return_inverse=True)
+        for k, cls_id in enumerate(class_ids):
+            rows = inverse == k
+            result_dict[self.class_names[int(cls_id)]] = [
+                {'coordinate': coordinate, 'confidence': confidence}
+                for coordinate, confidence in zip(boxes[rows].tolist(), confidences[rows].tolist())
+            ]
+
+        return result_dict
+
     def detect_objects(self, image):
         """Detect objects and return results in original API format"""
         try:
             # Preprocess
             img_tensor = self.preprocess_image(image)
-            
+
             # Inference
-            with torch.no_grad():
-                pred = self.model(img_tensor)[0]
-                
-                # Apply NMS
-                pred = non_max_suppression(pred, self.conf_thres, self.iou_thres, 
-                                         classes=None, agnostic=False)
-            
+            pred = self.infer(img_tensor)
+
             # Process results
-            result_dict = {}
-            
-            if pred[0] is not None and len(pred[0]):
-                detections = pred[0].cpu().numpy()
-                
-                # Scale coordinates back to original image size
-                scaled_detections = scale_coords(img_tensor.shape[2:], torch.tensor(detections[:, :4]), image.shape).round()
-                
-                # Process each detection
-                for i, (*xyxy, conf, cls) in enumerate(detections):
-                    cls_int = int(cls)
-                    if cls_int in self.class_names:
-                        class_name = self.class_names[cls_int]
-                        
-                        # Filter out low-confidence detections for the "person" class
-                        if class_name == 'person' and conf < 0.40:
-                            continue
-                        
-                        # Get scaled coordinates
-                        x1, y1, x2, y2 = scaled_detections[i].int().tolist()
-                        w = x2 - x1
-                        h = y2 - y1
-                        
-                        # Format as [x, y, w, h] to match original API
-                        coordinate = [x1, y1, w, h]
-                        
-                        # Initialize class in result dict if not exists
-                        if class_name not in result_dict:
-                            result_dict[class_name] = []
-                        
-                        # Add detection
-                        result_dict[class_name].append({
-                            'coordinate': coordinate,
-                            'confidence': float(conf)
-                        })
-            
-            return result_dict
-            
+            return self.postprocess(pred[0], img_tensor.shape[2:], image.shape)
+
         except Exception as e:
-            print(f"Error in detection: {e}")
+            logger.error("Error in detection: %s", e)
             return {}
 
+
+class BatchScheduler:
+    """Coalesces concurrent detection requests into batched forward passes.
+
+    Request threads letterbox their image directly into a slot of a shared
+    (pinned, on CUDA) host buffer and wait on a Future; a single worker thread
+    collects up to ``max_batch`` slots that arrive within ``max_wait`` seconds
+    of each other, copies them to the device on a dedicated copy stream, runs
+    them through the model as one batch on a compute stream and hands each
+    request back its own NMS output. Preprocessing of the next requests
+    therefore overlaps with inference of the current batch.
+    """
+
+    def __init__(self, detector, max_batch=8, max_wait=0.01):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        device = detector.device
+        img_size = detector.img_size
+        self.use_cuda = device.type == 'cuda'
+
+        # Twice the batch size so the next batch can be prepared while one is in flight
+        pool_size = 2 * max_batch
+        self._host = torch.empty((pool_size, 3, img_size, img_size), dtype=torch.uint8,
+                                 pin_memory=self.use_cuda)
+        self._host_np = self._host.numpy()
+        self._free_slots = queue.Queue()
+        for slot in range(pool_size):
+            self._free_slots.put(slot)
+
+        # Normalized model input, rewritten in place for every batch so large
+        # float tensors are not allocated and freed per request
+        self._input_buf = torch.empty((max_batch, 3, img_size, img_size), dtype=detector.input_dtype,
+                                      device=device)
+
+        if self.use_cuda:
+            self._device_buf = torch.empty((max_batch, 3, img_size, img_size), dtype=torch.uint8,
+                                           device=device)
+            self._copy_stream = torch.cuda.Stream(device=device)
+            self._compute_stream = torch.cuda.Stream(device=device)
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+        self._worker = threading.Thread(target=self._run, name='detector-batch', daemon=True)
+        self._worker.start()
+
+    def submit(self, image, timeout=None):
+        """Preprocess a BGR image into a free host slot and return a Future for its detections"""
+        slot = self._free_slots.get(timeout=timeout)
+        try:
+            self.detector.letterbox_into(image, self._host_np[slot])
+        except Exception:
+            self._free_slots.put(slot)
+            raise
+
+        future = Future()
+        with self._cond:
+            self._queue.append((slot, future))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        """Block until work is available, then collect a batch within the wait window"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(len(self._queue), self.max_batch)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _release(self, slots):
+        for slot in slots:
+            self._free_slots.put(slot)
+
+    def _infer_cuda(self, slots):
+        n = len(slots)
+
+        # Async H2D copies from pinned memory on the copy stream
+        with torch.cuda.stream(self._copy_stream):
+            for i, slot in enumerate(slots):
+                self._device_buf[i].copy_(self._host[slot], non_blocking=True)
+            copied = torch.cuda.Event()
+            copied.record(self._copy_stream)
+
+        # Host slots can be refilled as soon as the copies have landed
+        copied.synchronize()
+        self._release(slots)
+
+        with torch.cuda.stream(self._compute_stream):
+            self._compute_stream.wait_event(copied)
+            batch = self.detector.normalize(self._device_buf[:n], out=self._input_buf[:n])
+            pred = self.detector.infer(batch)
+
+        # Results are consumed from the request threads' streams
+        self._compute_stream.synchronize()
+        return pred
+
+    def _infer_cpu(self, slots):
+        n = len(slots)
+        batch = self._host[list(slots)]
+        self._release(slots)
+        return self.detector.infer(self.detector.normalize(batch, out=self._input_buf[:n]))
+
+    def _run(self):
+        torch.set_grad_enabled(False)
+        while True:
+            batch = self._next_batch()
+            slots, futures = zip(*batch)
+
+            try:
+                if self.use_cuda:
+                    pred = self._infer_cuda(slots)
+                else:
+                    pred = self._infer_cpu(slots)
+            except Exception as e:
+                logger.error("Error in batched detection: %s", e)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, detections in zip(futures, pred):
+                future.set_result(detections)
+
+
 # Global detector instance
 _detector = None
+_scheduler = None
+_init_lock = threading.RLock()
+
+# Device used for inference ('cpu', '0', '0,1', ...)
+DETECTOR_DEVICE = os.environ.get('DETECTOR_DEVICE', 'cpu')
+
+# Micro-batching settings
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT = float(os.environ.get('BATCH_MAX_WAIT_MS', 10)) / 1000.0
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 30))
 
 def get_detector():
     """Get or create detector instance"""
     global _detector
     if _detector is None:
-        _detector = ConstructionVehicleDetector()
+        with _init_lock:
+            if _detector is None:
+                _detector = ConstructionVehicleDetector(device=DETECTOR_DEVICE, max_batch=BATCH_MAX_SIZE)
     return _detector
 
+def get_batch_scheduler():
+    """Get or create batch scheduler instance"""
+    global _scheduler
+    if _scheduler is None:
+        with _init_lock:
+            if _scheduler is None:
+                _scheduler = BatchScheduler(get_detector(), max_batch=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT)
+    return _scheduler
+
+# The API never trains: disable autograd (grad mode is per thread, so the
+# batch worker thread disables it again for itself)
+torch.set_grad_enabled(False)
+
+# Create the CUDA context once per process, before the first request
+if DETECTOR_DEVICE != 'cpu' and torch.cuda.is_available():
+    torch.cuda.init()
+
+# Build the detector and batch worker at import time so the first request
+# does not pay model loading and warmup (set EAGER_INIT=0 to defer)
+if os.environ.get('EAGER_INIT', '1') == '1':
+    get_batch_scheduler()
+
 def process_image_multi_detector(numpy_image):
     """Main function to maintain compatibility with original API.
 
     Returns:
-        Tuple of (detection_results, original_size) where:
+        Tuple of (detection_results, original_size, image) where:
             - detection_results: dict with class names as keys
             - original_size: tuple (width, height) of original image
+            - image: decoded BGR image (numpy array), or None on error
     """
     try:
         # Decode numpy array to image
@@ -151,17 +490,17 @@ def process_image_multi_detector(numpy_image):
         img_h, img_w = image_decode_bs64.shape[:2]
         original_size = (img_w, img_h)
 
-        # Save the image as jpg (keeping original functionality)
-        cv2.imwrite('./image.jpg', image_decode_bs64)
-
-        # Get detector and run inference
+        # Get detector and run inference through the batch scheduler
         detector = get_detector()
-        result = detector.detect_objects(image_decode_bs64)
+        future = get_batch_scheduler().submit(image_decode_bs64, timeout=BATCH_TIMEOUT)
+        detections = future.result(timeout=BATCH_TIMEOUT)
+        input_shape = (detector.img_size, detector.img_size)
+        result = detector.postprocess(detections, input_shape, image_decode_bs64.shape)
 
-        print(f'Detection results: {result}')
-        print(f'Original image size: {original_size}')
-        return result, original_size
+        logger.debug('Detection results: %s', result)
+        logger.debug('Original image size: %s', original_size)
+        return result, original_size, image_decode_bs64
 
     except Exception as e:
-        print(f"Error in process_image_multi_detector: {e}")
-        return {}, (0, 0)
\ No newline at end of file
+        logger.error("Error in process_image_multi_detector: %s", e)
+        return {}, (0, 0), None
\ No newline at end of file
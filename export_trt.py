@@ -0,0 +1,90 @@
+"""
+Export the YOLOv7 detector to a TensorRT FP16 engine.
+
+The PyTorch checkpoint is first exported to ONNX with a dynamic batch axis,
+then compiled with trtexec. detector.py loads the resulting engine
+automatically (same path as the weights with an .engine suffix) when
+TensorRT is installed and the detector runs on a CUDA device.
+
+Usage:
+    python export_trt.py --weights yolov7_model/best.pt --img-size 1280 --max-batch 8
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+import torch
+
+# Add yolov7_model directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'yolov7_model'))
+
+from yolov7_model.models.experimental import attempt_load
+
+
+class DetectionOutput(torch.nn.Module):
+    """Wraps the YOLOv7 model so the exported graph has a single prediction output"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model(images)[0]
+
+
+def export_onnx(weights, onnx_path, img_size):
+    """Export the checkpoint to ONNX with a dynamic batch dimension"""
+    model = attempt_load(weights, map_location='cpu')
+    model.eval()
+
+    dummy = torch.zeros(1, 3, img_size, img_size)
+    torch.onnx.export(
+        DetectionOutput(model),
+        dummy,
+        onnx_path,
+        opset_version=12,
+        input_names=['images'],
+        output_names=['output'],
+        dynamic_axes={'images': {0: 'batch'}, 'output': {0: 'batch'}}
+    )
+    print(f"ONNX model saved to: {onnx_path}")
+
+
+def build_engine(onnx_path, engine_path, img_size, max_batch):
+    """Build an FP16 TensorRT engine supporting batch sizes 1..max_batch"""
+    shape = f"3x{img_size}x{img_size}"
+    command = [
+        'trtexec',
+        f'--onnx={onnx_path}',
+        '--fp16',
+        f'--minShapes=images:1x{shape}',
+        f'--optShapes=images:{max_batch}x{shape}',
+        f'--maxShapes=images:{max_batch}x{shape}',
+        f'--saveEngine={engine_path}',
+    ]
+    print(f"Running: {' '.join(command)}")
+    subprocess.run(command, check=True)
+    print(f"TensorRT engine saved to: {engine_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export YOLOv7 weights to a TensorRT FP16 engine')
+    parser.add_argument('--weights', default='yolov7_model/best.pt', help='PyTorch checkpoint path')
+    parser.add_argument('--img-size', type=int, default=1280, help='Inference image size')
+    parser.add_argument('--max-batch', type=int, default=8, help='Largest batch the engine accepts')
+    parser.add_argument('--skip-engine', action='store_true', help='Only export ONNX')
+    args = parser.parse_args()
+
+    base_path = os.path.splitext(args.weights)[0]
+    onnx_path = base_path + '.onnx'
+    engine_path = base_path + '.engine'
+
+    export_onnx(args.weights, onnx_path, args.img_size)
+    if not args.skip_engine:
+        build_engine(onnx_path, engine_path, args.img_size, args.max_batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,10 @@ Usage:
 
     result = blur_heads(
         person_coordinates=[[x, y, w, h], ...],
-        image_path='./image.jpg',
+        image=decoded_bgr_image,
         original_size=(img_width, img_height),
-        mode='standard'  # or 'fast'
+        mode='standard',  # or 'fast'
+        encoding='base64'  # or 'jpeg' for raw JPEG bytes
     )
 
 Modes:
@@ -20,16 +21,19 @@ Modes:
     - 'fast': Skip subframes where person height < 10% of original image
 
 Returns:
-    Base64 encoded JPEG string with blurred heads, or None if no blurring applied.
+    Base64 encoded JPEG string (or raw JPEG bytes with encoding='jpeg') with
+    blurred heads, or None if no blurring applied.
 """
 
 from .head_detector import blur_heads, get_processing_stats, should_process_person
-from .pose_head import detect_head_in_subframe, get_pose_head_detector
+from .pose_head import detect_head_in_subframe, detect_heads_in_subframes, get_pose_head_detector
 from .blur_utils import (
     apply_gaussian_blur,
     apply_fallback_blur,
     encode_image_base64,
-    calculate_head_bbox_from_landmarks
+    encode_image_jpeg,
+    calculate_head_bbox_from_landmarks,
+    calculate_head_bboxes
 )
 
 __version__ = '4.0.0'
@@ -38,9 +42,12 @@ __all__ = [
     'get_processing_stats',
     'should_process_person',
     'detect_head_in_subframe',
+    'detect_heads_in_subframes',
     'get_pose_head_detector',
     'apply_gaussian_blur',
     'apply_fallback_blur',
     'encode_image_base64',
+    'encode_image_jpeg',
     'calculate_head_bbox_from_landmarks',
+    'calculate_head_bboxes',
 ]
@@ -1,22 +1,68 @@
 """
 Blurring utilities for head/face privacy protection.
-Provides Gaussian blur application, fallback blur logic, and base64 encoding.
+Provides Gaussian blur application, fallback blur logic, and JPEG/base64 encoding.
 """
 
 import cv2
 import base64
+import logging
 import numpy as np
+from numba import njit
 
+logger = logging.getLogger(__name__)
 
-def apply_gaussian_blur(image, bbox, kernel_size=(99, 99), sigma=30):
+
+# Downscale factor used by the fast (pyramid) blur
+FAST_BLUR_DOWNSCALE = 16
+
+# Head landmark names in MediaPipe Pose index order (landmarks 0-8); this is
+# the row order of the landmark arrays passed to calculate_head_bboxes
+HEAD_LANDMARK_NAMES = (
+    'nose',
+    'left_eye_inner',
+    'left_eye',
+    'left_eye_outer',
+    'right_eye_inner',
+    'right_eye',
+    'right_eye_outer',
+    'left_ear',
+    'right_ear',
+)
+
+
+def _blur_region(image, x1, y1, x2, y2, kernel_size=(99, 99), sigma=30, quality='fast'):
+    """
+    Blur image[y1:y2, x1:x2] in place. Internal helper: the region must
+    already be clipped to the image and non-empty.
+    """
+    region = image[y1:y2, x1:x2]
+
+    if quality == 'high':
+        blurred = cv2.GaussianBlur(region, kernel_size, sigma)
+    else:
+        # Shrink, smooth the small image and scale back up: visually equivalent
+        # censoring for a fraction of the work of a 99x99 kernel
+        region_h, region_w = region.shape[:2]
+        small = cv2.resize(
+            region,
+            (max(1, region_w // FAST_BLUR_DOWNSCALE), max(1, region_h // FAST_BLUR_DOWNSCALE)),
+            interpolation=cv2.INTER_AREA
+        )
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        blurred = cv2.resize(small, (region_w, region_h), interpolation=cv2.INTER_LINEAR)
+    image[y1:y2, x1:x2] = blurred
+
+
+def apply_gaussian_blur(image, bbox, kernel_size=(99, 99), sigma=30, quality='fast'):
     """
     Apply Gaussian blur to a specific region of the image.
 
     Args:
         image: OpenCV image (numpy array, modified in place)
         bbox: Bounding box tuple (x, y, w, h)
-        kernel_size: Gaussian kernel size (must be odd numbers)
-        sigma: Gaussian sigma value
+        kernel_size: Gaussian kernel size (must be odd numbers), 'high' quality only
+        sigma: Gaussian sigma value, 'high' quality only
+        quality: 'fast' (downsample-blur-upsample) or 'high' (full Gaussian kernel)
 
     Returns:
         True if blur was applied, False otherwise
@@ -38,15 +84,10 @@ def apply_gaussian_blur(image, bbox, kernel_size=(99, 99), sigma=30):
         return False
 
     try:
-        region = image[y:y2, x:x2]
-        if region.size == 0:
-            return False
-
-        blurred = cv2.GaussianBlur(region, kernel_size, sigma)
-        image[y:y2, x:x2] = blurred
+        _blur_region(image, x, y, x2, y2, kernel_size, sigma, quality)
         return True
     except Exception as e:
-        print(f"Error applying blur: {e}")
+        logger.error("Error applying blur: %s", e)
         return False
 
 
@@ -67,7 +108,7 @@ def apply_fallback_blur(image, person_bbox, head_ratio=0.25):
 
     # Only apply to standing persons (height > width * 1.5)
     if h <= w * 1.5:
-        print(f"Skipping fallback blur: not standing (h={h}, w={w})")
+        logger.debug("Skipping fallback blur: not standing (h=%d, w=%d)", h, w)
         return False
 
     # Calculate head region (top portion)
@@ -79,11 +120,29 @@ def apply_fallback_blur(image, person_bbox, head_ratio=0.25):
 
     result = apply_gaussian_blur(image, head_bbox)
     if result:
-        print(f"Applied fallback blur to top {head_ratio*100:.0f}% at: x={x}, y={y}, w={w}, h={head_height}")
+        logger.debug("Applied fallback blur to top %.0f%% at: x=%d, y=%d, w=%d, h=%d", head_ratio * 100, x, y, w, head_height)
 
     return result
 
 
+def encode_image_jpeg(image):
+    """
+    Encode an OpenCV image to JPEG bytes.
+
+    Args:
+        image: OpenCV image (numpy array)
+
+    Returns:
+        JPEG encoded bytes, or None on error
+    """
+    try:
+        _, buffer = cv2.imencode('.jpg', image)
+        return buffer.tobytes()
+    except Exception as e:
+        logger.error("Error encoding image: %s", e)
+        return None
+
+
 def encode_image_base64(image):
     """
     Encode an OpenCV image to base64 JPEG string.
@@ -96,12 +155,92 @@ def encode_image_base64(image):
     """
     try:
         _, buffer = cv2.imencode('.jpg', image)
-        return base64.b64encode(buffer).decode('utf-8')
+        # Encode straight from the imencode buffer without an intermediate bytes copy
+        return base64.b64encode(memoryview(buffer)).decode('utf-8')
     except Exception as e:
-        print(f"Error encoding image: {e}")
+        logger.error("Error encoding image: %s", e)
         return None
 
 
+@njit(cache=True)
+def calculate_head_bboxes(landmarks, image_sizes, padding=0.2, scale=2.0):
+    """
+    Calculate head bounding boxes for a batch of persons from pose landmarks.
+
+    Args:
+        landmarks: float32 array (N, 9, 3) of (x, y, visibility) in subframe pixel
+            coordinates, rows ordered as HEAD_LANDMARK_NAMES (missing landmarks
+            should have a visibility of -1)
+        image_sizes: Integer array (N, 2) of subframe (height, width)
+        padding: Extra padding around detected landmarks (ratio)
+        scale: Scale factor for final box size (2.0 = 100% bigger, doubled)
+
+    Returns:
+        int32 array (N, 4) of head boxes (x, y, w, h) relative to each subframe;
+        rows without a valid head box are all zeros
+    """
+    n = landmarks.shape[0]
+    boxes = np.zeros((n, 4), dtype=np.int32)
+
+    for i in range(n):
+        # Bounds of the visible landmarks
+        count = 0
+        min_x = np.inf
+        min_y = np.inf
+        max_x = -np.inf
+        max_y = -np.inf
+        for j in range(landmarks.shape[1]):
+            if landmarks[i, j, 2] > 0.5:  # Only use visible landmarks
+                x = landmarks[i, j, 0]
+                y = landmarks[i, j, 1]
+                min_x = min(min_x, x)
+                max_x = max(max_x, x)
+                min_y = min(min_y, y)
+                max_y = max(max_y, y)
+                count += 1
+
+        if count < 2:  # Need at least 2 points to estimate head
+            continue
+
+        width = max_x - min_x
+        height = max_y - min_y
+
+        # Estimate full head size (landmarks only cover part of head)
+        estimated_head_height = height * 2.0
+        estimated_head_width = max(width * 1.5, estimated_head_height * 0.8)
+
+        # Center the box on the landmarks, shifted up slightly
+        center_x = (min_x + max_x) / 2
+        center_y = (min_y + max_y) / 2 - height * 0.3
+
+        # Apply padding and scale factor
+        final_width = estimated_head_width * (1 + padding) * scale
+        final_height = estimated_head_height * (1 + padding) * scale
+
+        x = int(center_x - final_width / 2)
+        y = int(center_y - final_height / 2)
+        w = int(final_width)
+        h = int(final_height)
+
+        # Clamp to image bounds
+        img_h = image_sizes[i, 0]
+        img_w = image_sizes[i, 1]
+        x = max(0, x)
+        y = max(0, y)
+        w = min(w, img_w - x)
+        h = min(h, img_h - y)
+
+        if w <= 0 or h <= 0:
+            continue
+
+        boxes[i, 0] = x
+        boxes[i, 1] = y
+        boxes[i, 2] = w
+        boxes[i, 3] = h
+
+    return boxes
+
+
 def calculate_head_bbox_from_landmarks(landmarks, person_bbox, image_shape, padding=0.2, scale=2.0):
     """
     Calculate a head bounding box from pose landmarks.
@@ -116,55 +255,13 @@ def calculate_head_bbox_from_landmarks(landmarks, person_bbox, image_shape, padd
     Returns:
         Head bounding box (x, y, w, h) relative to the subframe, or None
     """
-    head_landmark_names = ['nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
-                           'left_eye_inner', 'right_eye_inner', 'left_eye_outer', 'right_eye_outer']
-
-    # Collect valid landmarks
-    points = []
-    for name in head_landmark_names:
+    landmarks_arr = np.full((1, len(HEAD_LANDMARK_NAMES), 3), -1.0, dtype=np.float32)
+    for row, name in enumerate(HEAD_LANDMARK_NAMES):
         if name in landmarks:
-            x, y, visibility = landmarks[name]
-            if visibility > 0.5:  # Only use visible landmarks
-                points.append((x, y))
+            landmarks_arr[0, row] = landmarks[name]
 
-    if len(points) < 2:  # Need at least 2 points to estimate head
-        return None
-
-    # Calculate bounding box around landmarks
-    xs = [p[0] for p in points]
-    ys = [p[1] for p in points]
-
-    min_x, max_x = min(xs), max(xs)
-    min_y, max_y = min(ys), max(ys)
-
-    # Add padding
-    width = max_x - min_x
-    height = max_y - min_y
-
-    # Estimate full head size (landmarks only cover part of head)
-    # Head is typically taller than the face landmarks suggest
-    estimated_head_height = height * 2.0  # Double the landmark height
-    estimated_head_width = max(width * 1.5, estimated_head_height * 0.8)
-
-    # Center the box on the landmarks
-    center_x = (min_x + max_x) / 2
-    center_y = (min_y + max_y) / 2 - height * 0.3  # Shift up slightly
-
-    # Apply padding and scale factor (scale=2.0 doubles the box size proportionally)
-    final_width = estimated_head_width * (1 + padding) * scale
-    final_height = estimated_head_height * (1 + padding) * scale
-
-    x = int(center_x - final_width / 2)
-    y = int(center_y - final_height / 2)
-    w = int(final_width)
-    h = int(final_height)
-
-    # Clamp to image bounds
-    img_h, img_w = image_shape[:2]
-    x = max(0, x)
-    y = max(0, y)
-    w = min(w, img_w - x)
-    h = min(h, img_h - y)
+    image_sizes = np.array([image_shape[:2]], dtype=np.int32)
+    x, y, w, h = calculate_head_bboxes(landmarks_arr, image_sizes, padding, scale)[0].tolist()
 
     if w <= 0 or h <= 0:
         return None
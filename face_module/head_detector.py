@@ -3,10 +3,13 @@ Main head detection orchestrator for privacy blurring.
 Coordinates MediaPipe Pose detection with fallback logic.
 """
 
-import cv2
-from .pose_head import detect_head_in_subframe
-from .blur_utils import apply_gaussian_blur, apply_fallback_blur, encode_image_base64
+import logging
 
+import numpy as np
+from .pose_head import detect_heads_in_subframes
+from .blur_utils import _blur_region, apply_fallback_blur, encode_image_base64, encode_image_jpeg
+
+logger = logging.getLogger(__name__)
 
 # Configuration constants
 MIN_RELATIVE_HEIGHT = 0.10  # 10% of original image height for 'fast' mode
@@ -14,25 +17,24 @@ CONFIDENCE_THRESHOLD = 0.5  # Minimum confidence to trust detection
 MIN_SUBFRAME_SIZE = 30  # Minimum pixel size for subframe processing
 
 
-def blur_heads(person_coordinates, image_path, original_size, mode='standard'):
+def blur_heads(person_coordinates, image, original_size, mode='standard', encoding='base64'):
     """
     Main function to blur heads in detected person regions.
 
     Args:
         person_coordinates: List of [x, y, w, h] bounding boxes from detector.py
-        image_path: Path to the saved image file (e.g., './image.jpg')
+        image: Decoded BGR image (numpy array, blurred in place)
         original_size: Tuple (width, height) of original image before processing
         mode: 'standard' (process all) or 'fast' (skip small subframes)
+        encoding: 'base64' (JPEG as base64 string) or 'jpeg' (raw JPEG bytes)
 
     Returns:
-        Base64 encoded blurred image string, or None if no blurring applied
+        Encoded blurred image (see ``encoding``), or None if no blurring applied
     """
-    print(f'Starting head detection module (mode={mode})')
+    logger.debug('Starting head detection module (mode=%s)', mode)
 
-    # Load the image
-    image = cv2.imread(image_path)
     if image is None:
-        raise ValueError(f"Could not read image file: {image_path}")
+        raise ValueError("No image provided for head blurring")
 
     img_h, img_w = image.shape[:2]
     original_w, original_h = original_size
@@ -40,63 +42,85 @@ def blur_heads(person_coordinates, image_path, original_size, mode='standard'):
     # Track if any blurring was applied
     blur_applied = False
 
-    # Process each person bounding box
+    # First pass: collect the person subframes worth running pose detection on
+    candidates = []
     for idx, (px, py, pw, ph) in enumerate(person_coordinates):
-        print(f"Processing person {idx + 1}/{len(person_coordinates)}: bbox=({px}, {py}, {pw}, {ph})")
+        logger.debug("Processing person %d/%d: bbox=(%d, %d, %d, %d)", idx + 1, len(person_coordinates), px, py, pw, ph)
 
         # Calculate relative height compared to original image
         relative_height = ph / original_h
 
         # Fast mode: skip small subframes
         if mode == 'fast' and relative_height < MIN_RELATIVE_HEIGHT:
-            print(f"  Skipping (fast mode): relative_height={relative_height:.3f} < {MIN_RELATIVE_HEIGHT}")
+            logger.debug("  Skipping (fast mode): relative_height=%.3f < %s", relative_height, MIN_RELATIVE_HEIGHT)
             continue
 
         # Skip very small subframes (would fail anyway)
         if pw < MIN_SUBFRAME_SIZE or ph < MIN_SUBFRAME_SIZE:
-            print(f"  Skipping: subframe too small ({pw}x{ph} < {MIN_SUBFRAME_SIZE})")
+            logger.debug("  Skipping: subframe too small (%dx%d < %d)", pw, ph, MIN_SUBFRAME_SIZE)
             continue
 
         # Extract subframe
         subframe = image[py:py+ph, px:px+pw]
         if subframe.size == 0:
-            print(f"  Skipping: empty subframe")
+            logger.debug("  Skipping: empty subframe")
             continue
 
-        # Detect head using MediaPipe Pose
-        head_bbox, confidence, is_valid = detect_head_in_subframe(
-            subframe,
-            confidence_threshold=CONFIDENCE_THRESHOLD
-        )
+        candidates.append(((px, py, pw, ph), subframe))
+
+    # Detect heads for all collected subframes in a single batched call,
+    # before any blur touches the image (each BGR crop is converted to RGB
+    # after the pose ROI downscale, so on at most roi_size pixels)
+    detections = detect_heads_in_subframes(
+        [subframe for _, subframe in candidates],
+        confidence_threshold=CONFIDENCE_THRESHOLD
+    )
+
+    # Second pass: collect detected heads, fall back for low-confidence persons
+    head_boxes = []
+    head_confidences = []
+    for (person_bbox, _), (head_bbox, confidence, is_valid) in zip(candidates, detections):
+        px, py, pw, ph = person_bbox
 
         if is_valid and head_bbox is not None:
-            # Convert subframe-relative coordinates to image-absolute coordinates
+            # Convert subframe-relative coordinates to image-absolute (x1, y1, x2, y2)
             hx, hy, hw, hh = head_bbox
-            abs_head_bbox = (px + hx, py + hy, hw, hh)
-
-            # Apply blur to detected head
-            if apply_gaussian_blur(image, abs_head_bbox):
-                blur_applied = True
-                print(f"  Blurred head at: x={px + hx}, y={py + hy}, w={hw}, h={hh} (confidence={confidence:.2f})")
-            else:
-                print(f"  Failed to apply blur to detected head")
+            head_boxes.append((px + hx, py + hy, px + hx + hw, py + hy + hh))
+            head_confidences.append(confidence)
 
         else:
             # No valid detection or low confidence - apply fallback
-            print(f"  No valid head detection (confidence={confidence:.2f}), checking fallback...")
+            logger.debug("  No valid head detection (confidence=%.2f), checking fallback...", confidence)
 
             # Use original person bbox for fallback
-            person_bbox = (px, py, pw, ph)
             if apply_fallback_blur(image, person_bbox):
                 blur_applied = True
             else:
-                print(f"  Fallback not applied (person not standing)")
+                logger.debug("  Fallback not applied (person not standing)")
+
+    if head_boxes:
+        # Clip all head boxes to the image bounds at once and drop empty ones
+        heads = np.array(head_boxes, dtype=np.int32)
+        np.clip(heads[:, 0::2], 0, img_w, out=heads[:, 0::2])
+        np.clip(heads[:, 1::2], 0, img_h, out=heads[:, 1::2])
+        valid = (heads[:, 2] > heads[:, 0]) & (heads[:, 3] > heads[:, 1])
+
+        if not valid.all():
+            logger.debug("  Failed to apply blur to %d detected head(s)", int((~valid).sum()))
+
+        # Apply blur to detected heads
+        for (x1, y1, x2, y2), confidence in zip(heads[valid].tolist(), np.asarray(head_confidences)[valid].tolist()):
+            _blur_region(image, x1, y1, x2, y2)
+            blur_applied = True
+            logger.debug("  Blurred head at: x=%d, y=%d, w=%d, h=%d (confidence=%.2f)", x1, y1, x2 - x1, y2 - y1, confidence)
 
     # Return result
     if blur_applied:
+        if encoding == 'jpeg':
+            return encode_image_jpeg(image)
         return encode_image_base64(image)
     else:
-        print("No blurring applied to any person")
+        logger.debug("No blurring applied to any person")
         return None
 
 
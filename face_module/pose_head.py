@@ -2,11 +2,37 @@
 MediaPipe Pose-based head detection module.
 Uses body pose landmarks to locate head position, which works even when
 the person is facing away from the camera.
+
+Each PoseHeadDetector owns native MediaPipe graphs. They are released by
+close(), when the detector is garbage collected, or at interpreter exit;
+long-running services that create their own detectors should bound their
+lifetime with ``with PoseHeadDetector(...) as detector:``.
 """
 
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
 import cv2
 import mediapipe as mp
-from .blur_utils import calculate_head_bbox_from_landmarks
+import numpy as np
+from .blur_utils import HEAD_LANDMARK_NAMES, calculate_head_bboxes
+
+logger = logging.getLogger(__name__)
+
+
+def _close_pose_graphs(graphs):
+    """Close a detector's MediaPipe graphs (runs at most once, via weakref.finalize)."""
+    for graph in graphs:
+        graph.close()
+    graphs.clear()
+
+
+# MediaPipe Pose landmark indices and names of the head-related points (landmarks 0-8)
+_HEAD_NAMES = HEAD_LANDMARK_NAMES
+_HEAD_IDX = tuple(range(len(_HEAD_NAMES)))
+_HEAD_COUNT = len(_HEAD_IDX)
 
 
 class PoseHeadDetector:
@@ -16,48 +42,215 @@ class PoseHeadDetector:
     """
 
     # MediaPipe Pose landmark indices for head-related points
-    LANDMARK_NAMES = {
-        0: 'nose',
-        1: 'left_eye_inner',
-        2: 'left_eye',
-        3: 'left_eye_outer',
-        4: 'right_eye_inner',
-        5: 'right_eye',
-        6: 'right_eye_outer',
-        7: 'left_ear',
-        8: 'right_ear',
-    }
-
-    def __init__(self, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+    LANDMARK_NAMES = dict(zip(_HEAD_IDX, _HEAD_NAMES))
+
+    def __init__(self, min_detection_confidence=0.5, min_tracking_confidence=0.5,
+                 video_mode=False, reacquire_threshold=0.5, max_tracks=16,
+                 model_complexity=0, fallback_threshold=0.5,
+                 min_std=8.0, max_aspect=6.0, cache_size=4, roi_size=256):
         """
         Initialize the Pose Head Detector.
 
         Args:
             min_detection_confidence: Minimum confidence for pose detection
             min_tracking_confidence: Minimum confidence for landmark tracking
+            video_mode: Track landmarks across frames for calls that pass a
+                track_id (one tracking graph per track) instead of running the
+                pose detector on every frame. Calls without a track_id always
+                use static image mode.
+            reacquire_threshold: In video mode, average head visibility below
+                which a track's graph is reset to force re-detection
+            max_tracks: In video mode, maximum number of per-track graphs kept
+                open; the least recently used track is released beyond this
+            model_complexity: MediaPipe Pose model (0=lite, 1=full, 2=heavy).
+                Lite produces the same head landmarks (0-8) at a fraction of
+                the cost.
+            fallback_threshold: When running the lite model, average head
+                visibility (0 when no pose is found) below which a static image
+                is re-run through a full (complexity 1) model. None disables
+                the fallback. The lite model is downloaded by MediaPipe on
+                first use (the Docker image fetches it at build time).
+            min_std: Subframes whose largest per-channel standard deviation
+                (measured on a 32x32 thumbnail) is below this are treated as
+                featureless and skipped without running Pose
+            max_aspect: Subframes with a longer/shorter side ratio above this
+                are skipped (pose landmarks are unreliable on thin strips)
+            cache_size: Number of recent static-image results kept, keyed by
+                the subframe's 32x32 thumbnail, so repeated identical crops
+                skip Pose entirely (0 disables; tracked calls are not cached)
+            roi_size: Subframes whose longer side exceeds this are downscaled
+                (aspect ratio preserved) before color conversion and Pose,
+                matching the 256px input of the pose models (None disables)
         """
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
-            static_image_mode=True,  # Process individual images, not video
-            model_complexity=1,  # 0=lite, 1=full, 2=heavy
+        self.min_detection_confidence = min_detection_confidence
+        self.min_tracking_confidence = min_tracking_confidence
+        self.video_mode = video_mode
+        self.reacquire_threshold = reacquire_threshold
+        self.model_complexity = model_complexity
+        self.fallback_threshold = fallback_threshold
+        self.min_std = min_std
+        self.max_aspect = max_aspect
+
+        # Every open graph, closed by the finalizer even if close() is never called
+        self._graphs = []
+        self._finalizer = weakref.finalize(self, _close_pose_graphs, self._graphs)
+
+        # Process individual images, not video
+        self.pose = self._create_pose(static_image_mode=True)
+
+        # Tracking graphs keyed by track id, least recently used first (video mode only)
+        self.max_tracks = max(1, max_tracks)
+        self._per_track_pose = OrderedDict()
+
+        # Full model for low-confidence lite results, created on first use
+        self._fallback_pose = None
+
+        # Recent static-image results: thumbnail key -> (landmarks, confidence)
+        self.cache_size = cache_size
+        self._result_cache = OrderedDict()
+
+        # Reused RGB conversion and downscale buffers (reallocated only when the shape changes)
+        self.roi_size = roi_size
+        self._rgb_buf = None
+        self._roi_buf = None
+        logger.info("PoseHeadDetector initialized with MediaPipe Pose (model_complexity=%d)",
+                    model_complexity)
+
+    def _create_pose(self, static_image_mode, model_complexity=None):
+        """Create a MediaPipe Pose graph with this detector's settings."""
+        if model_complexity is None:
+            model_complexity = self.model_complexity
+
+        pose = self.mp_pose.Pose(
+            static_image_mode=static_image_mode,
+            model_complexity=model_complexity,
             enable_segmentation=False,
-            min_detection_confidence=min_detection_confidence,
-            min_tracking_confidence=min_tracking_confidence
+            min_detection_confidence=self.min_detection_confidence,
+            min_tracking_confidence=self.min_tracking_confidence
         )
-        print("PoseHeadDetector initialized with MediaPipe Pose")
+        self._graphs.append(pose)
+        return pose
+
+    def _pose_for_track(self, track_id):
+        """Return the Pose graph to use for a track (the static graph outside video mode)."""
+        if not self.video_mode or track_id is None:
+            return self.pose
 
-    def detect_head(self, subframe):
+        pose = self._per_track_pose.get(track_id)
+        if pose is not None:
+            self._per_track_pose.move_to_end(track_id)
+            return pose
+
+        # Bound memory when callers never release ended tracks
+        while len(self._per_track_pose) >= self.max_tracks:
+            self.release_track(next(iter(self._per_track_pose)))
+
+        pose = self._create_pose(static_image_mode=False)
+        self._per_track_pose[track_id] = pose
+        return pose
+
+    def _get_fallback_pose(self):
+        """Return the full-model static graph used when the lite model is unsure."""
+        if self._fallback_pose is None:
+            logger.info("Creating full-complexity fallback Pose model")
+            self._fallback_pose = self._create_pose(static_image_mode=True, model_complexity=1)
+        return self._fallback_pose
+
+    def _head_landmarks(self, pose, rgb_image, w, h):
+        """
+        Run a Pose graph and extract the head landmarks.
+
+        Args:
+            pose: MediaPipe Pose graph to run
+            rgb_image: RGB image of the person region
+            w: Width of the image in pixels
+            h: Height of the image in pixels
+
+        Returns:
+            (1, 9, 3) float32 array of (x, y, visibility) in pixel
+            coordinates, or None if no pose was found
+        """
+        # Read-only input lets MediaPipe skip its own copy
+        flags = rgb_image.flags
+        flags.writeable = False
+        try:
+            pose_landmarks = pose.process(rgb_image).pose_landmarks
+        finally:
+            flags.writeable = True
+
+        if not pose_landmarks:
+            return None
+
+        # Extract head landmarks (0-8, contiguous) as (x, y, visibility) rows,
+        # touching each protobuf message once
+        head_lms = pose_landmarks.landmark[:_HEAD_COUNT]
+        landmarks = np.array(
+            [[(lm.x, lm.y, lm.visibility) for lm in head_lms]],
+            dtype=np.float32
+        )
+
+        # Convert normalized coordinates to pixel coordinates
+        landmarks[0, :, :2] *= (w, h)
+        return landmarks
+
+    def release_track(self, track_id):
+        """Close the tracking graph of a track that has ended."""
+        pose = self._per_track_pose.pop(track_id, None)
+        if pose is not None:
+            self._graphs.remove(pose)
+            pose.close()
+
+    def detect_head(self, subframe, track_id=None, is_rgb=False):
         """
         Detect head region in a person subframe using pose estimation.
 
         Args:
             subframe: OpenCV image (BGR) of a cropped person region
+            track_id: Optional person track id; in video mode consecutive
+                subframes of the same track reuse MediaPipe's landmark tracker
+            is_rgb: subframe is already RGB (e.g. from an RGB video source);
+                skips the cvtColor. BGR crops are converted after the ROI
+                downscale, so prefer passing BGR when the source is BGR.
 
         Returns:
             Tuple of (head_bbox, confidence) where:
                 - head_bbox: (x, y, w, h) relative to subframe, or None
                 - confidence: Average visibility of head landmarks (0-1)
         """
+        landmarks, avg_confidence = self._detect_landmarks(subframe, track_id, is_rgb)
+        if landmarks is None:
+            return None, 0.0
+
+        # Calculate head bounding box from landmarks
+        h, w = subframe.shape[:2]
+        image_sizes = np.array([[h, w]], dtype=np.int32)
+        x, y, bw, bh = calculate_head_bboxes(landmarks, image_sizes)[0].tolist()
+        head_bbox = (x, y, bw, bh) if bw > 0 and bh > 0 else None
+
+        return head_bbox, avg_confidence
+
+    def _detect_landmarks(self, subframe, track_id=None, is_rgb=False):
+        """
+        Run pose estimation on a person subframe and extract its head landmarks.
+
+        Args:
+            subframe: Image of a cropped person region (BGR, or RGB if is_rgb)
+            track_id: Optional person track id (see detect_head)
+            is_rgb: subframe is already RGB
+
+        Returns:
+            Tuple of (landmarks, confidence) where landmarks is a (1, 9, 3)
+            float32 array of (x, y, visibility) in subframe pixels, or None
+        """
+        try:
+            return self._detect_landmarks_unchecked(subframe, track_id, is_rgb)
+        except (cv2.error, RuntimeError, ValueError):
+            logger.exception("Error in pose detection")
+            return None, 0.0
+
+    def _detect_landmarks_unchecked(self, subframe, track_id=None, is_rgb=False):
+        """_detect_landmarks without error handling (errors propagate to the caller)."""
         if subframe is None or subframe.size == 0:
             return None, 0.0
 
@@ -65,71 +258,174 @@ class PoseHeadDetector:
         if h < 20 or w < 20:  # Too small for pose detection
             return None, 0.0
 
-        try:
-            # Convert BGR to RGB for MediaPipe
-            rgb_image = cv2.cvtColor(subframe, cv2.COLOR_BGR2RGB)
-
-            # Run pose detection
-            results = self.pose.process(rgb_image)
+        if max(h, w) > self.max_aspect * min(h, w):  # Extreme strip
+            return None, 0.0
 
-            if not results.pose_landmarks:
-                return None, 0.0
+        # Skip near-uniform regions before paying for color conversion and Pose
+        small = cv2.resize(subframe, (32, 32), interpolation=cv2.INTER_AREA)
+        _, std = cv2.meanStdDev(small)
+        if std.max() < self.min_std:
+            return None, 0.0
 
-            # Extract head landmarks
-            landmarks = {}
-            visibilities = []
+        # Identical crop seen recently (static camera, idle subject): reuse its result
+        pose = self._pose_for_track(track_id)
+        cache_key = None
+        if pose is self.pose and self.cache_size > 0:
+            cache_key = (h, w, is_rgb, small.tobytes())
+            cached = self._result_cache.get(cache_key)
+            if cached is not None:
+                self._result_cache.move_to_end(cache_key)
+                return cached
 
-            for idx, name in self.LANDMARK_NAMES.items():
-                landmark = results.pose_landmarks.landmark[idx]
-                # Convert normalized coordinates to pixel coordinates
-                x = int(landmark.x * w)
-                y = int(landmark.y * h)
-                visibility = landmark.visibility
+        # Shrink large crops ourselves so conversion and MediaPipe's internal
+        # resize touch fewer pixels; landmarks are normalized, so w/h still apply
+        if self.roi_size and max(h, w) > self.roi_size:
+            scale = self.roi_size / max(h, w)
+            roi_w, roi_h = max(1, round(w * scale)), max(1, round(h * scale))
+            if self._roi_buf is None or self._roi_buf.shape[:2] != (roi_h, roi_w):
+                self._roi_buf = np.empty((roi_h, roi_w) + subframe.shape[2:], dtype=subframe.dtype)
+            subframe = cv2.resize(subframe, (roi_w, roi_h), dst=self._roi_buf, interpolation=cv2.INTER_AREA)
 
-                landmarks[name] = (x, y, visibility)
-                visibilities.append(visibility)
+        if is_rgb:
+            rgb_image = subframe
+            if not rgb_image.flags.c_contiguous:
+                # MediaPipe only references C-contiguous read-only data; copy views
+                # of a larger frame into the reused buffer
+                if self._rgb_buf is None or self._rgb_buf.shape != subframe.shape:
+                    self._rgb_buf = np.empty_like(subframe)
+                np.copyto(self._rgb_buf, subframe)
+                rgb_image = self._rgb_buf
+        else:
+            # Convert BGR to RGB for MediaPipe into the reused buffer
+            if self._rgb_buf is None or self._rgb_buf.shape != subframe.shape:
+                self._rgb_buf = np.empty_like(subframe)
+            rgb_image = cv2.cvtColor(subframe, cv2.COLOR_BGR2RGB, dst=self._rgb_buf)
 
-            # Calculate average confidence
-            avg_confidence = sum(visibilities) / len(visibilities) if visibilities else 0.0
+        # Run pose detection
+        landmarks = self._head_landmarks(pose, rgb_image, w, h)
+        avg_confidence = float(landmarks[0, :, 2].mean()) if landmarks is not None else 0.0
 
-            # Calculate head bounding box from landmarks
-            head_bbox = calculate_head_bbox_from_landmarks(
-                landmarks,
-                person_bbox=(0, 0, w, h),
-                image_shape=subframe.shape
-            )
+        # Two-tier cascade: retry unsure lite results, including crops where lite
+        # found no pose, with the full model so persons it would find still get
+        # a head blur (featureless and repeated crops never reach this point)
+        if (pose is self.pose and self.model_complexity == 0
+                and self.fallback_threshold is not None
+                and avg_confidence < self.fallback_threshold):
+            full_landmarks = self._head_landmarks(self._get_fallback_pose(), rgb_image, w, h)
+            if full_landmarks is not None:
+                full_confidence = float(full_landmarks[0, :, 2].mean())
+                if full_confidence > avg_confidence:
+                    landmarks, avg_confidence = full_landmarks, full_confidence
 
-            return head_bbox, avg_confidence
+        if cache_key is not None:
+            self._result_cache[cache_key] = (landmarks, avg_confidence)
+            if len(self._result_cache) > self.cache_size:
+                self._result_cache.popitem(last=False)
 
-        except Exception as e:
-            print(f"Error in pose detection: {e}")
+        if landmarks is None:
             return None, 0.0
 
+        # Weak tracked landmarks: force the detector to run on the next frame
+        if pose is not self.pose and avg_confidence < self.reacquire_threshold:
+            pose.reset()
+
+        return landmarks, avg_confidence
+
+    def detect_head_rgb(self, rgb_subframe, track_id=None):
+        """
+        Detect head region in an RGB person subframe (no color conversion).
+
+        Args:
+            rgb_subframe: RGB image of a cropped person region; may be a view
+                into a larger RGB frame (non-contiguous views are copied into
+                a reused buffer, which is still cheaper than a cvtColor pass)
+            track_id: Optional person track id (see detect_head)
+
+        Returns:
+            Tuple of (head_bbox, confidence), as detect_head
+        """
+        return self.detect_head(rgb_subframe, track_id, is_rgb=True)
+
+    def detect_heads_batched(self, subframes, track_ids=None, is_rgb=False):
+        """
+        Detect head regions in several person subframes in one call.
+
+        Pose runs once per subframe (MediaPipe Pose is single-person, so crops
+        cannot share one inference), but the head boxes of all subframes are
+        computed together in a single calculate_head_bboxes call.
+
+        Args:
+            subframes: List of OpenCV images (BGR) of cropped person regions
+            track_ids: Optional list of track ids, one per subframe (video mode)
+            is_rgb: Subframes are already RGB
+
+        Returns:
+            List of (head_bbox, confidence) tuples, one per subframe
+        """
+        n = len(subframes)
+        if track_ids is None:
+            track_ids = [None] * n
+
+        # Landmarks of all subframes in one array; rows without a pose stay invisible
+        landmarks = np.full((n, _HEAD_COUNT, 3), -1.0, dtype=np.float32)
+        image_sizes = np.zeros((n, 2), dtype=np.int32)
+        confidences = [0.0] * n
+
+        detect_landmarks = self._detect_landmarks
+        for i, (subframe, track_id) in enumerate(zip(subframes, track_ids)):
+            subframe_landmarks, confidence = detect_landmarks(subframe, track_id, is_rgb)
+            if subframe_landmarks is not None:
+                landmarks[i] = subframe_landmarks[0]
+                image_sizes[i] = subframe.shape[:2]
+                confidences[i] = confidence
+
+        results = []
+        for (x, y, bw, bh), confidence in zip(calculate_head_bboxes(landmarks, image_sizes).tolist(), confidences):
+            head_bbox = (x, y, bw, bh) if bw > 0 and bh > 0 else None
+            results.append((head_bbox, confidence))
+        return results
+
     def close(self):
-        """Release MediaPipe resources."""
-        if self.pose:
-            self.pose.close()
+        """Release MediaPipe resources (safe to call more than once)."""
+        self._finalizer()
+        self._per_track_pose.clear()
+        self._fallback_pose = None
+        self.pose = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
-# Singleton instance for efficiency
-_detector = None
+# One detector per thread: MediaPipe graphs (and the reused RGB buffer)
+# must not be driven by several threads at once. A thread's detector is
+# finalized (graphs closed) when the thread exits, the rest at interpreter exit.
+_tls = threading.local()
+_init_lock = threading.Lock()
 
 
 def get_pose_head_detector():
-    """Get or create singleton PoseHeadDetector instance."""
-    global _detector
-    if _detector is None:
-        _detector = PoseHeadDetector()
-    return _detector
+    """Get or create the calling thread's PoseHeadDetector instance."""
+    detector = getattr(_tls, 'detector', None)
+    if detector is None:
+        # Serialize graph construction; concurrent MediaPipe initialization is not safe
+        with _init_lock:
+            detector = PoseHeadDetector()
+        _tls.detector = detector
+    return detector
 
 
-def detect_head_in_subframe(subframe, confidence_threshold=0.5):
+def detect_head_in_subframe(subframe, confidence_threshold=0.5, track_id=None, is_rgb=False):
     """
     Convenience function to detect head in a subframe.
 
     Args:
         subframe: OpenCV image (BGR) of a cropped person region
         confidence_threshold: Minimum confidence to consider detection valid
+        track_id: Optional person track id (used by detectors in video mode)
+        is_rgb: subframe is already RGB (skips the color conversion)
 
     Returns:
         Tuple of (head_bbox, confidence, is_valid) where:
@@ -138,8 +434,31 @@ def detect_head_in_subframe(subframe, confidence_threshold=0.5):
             - is_valid: True if confidence >= threshold
     """
     detector = get_pose_head_detector()
-    head_bbox, confidence = detector.detect_head(subframe)
+    head_bbox, confidence = detector.detect_head(subframe, track_id, is_rgb)
 
     is_valid = head_bbox is not None and confidence >= confidence_threshold
 
     return head_bbox, confidence, is_valid
+
+
+def detect_heads_in_subframes(subframes, confidence_threshold=0.5, is_rgb=False):
+    """
+    Batched counterpart of detect_head_in_subframe.
+
+    Args:
+        subframes: List of OpenCV images (BGR) of cropped person regions
+        confidence_threshold: Minimum confidence to consider detection valid
+        is_rgb: Subframes are already RGB
+
+    Returns:
+        List of (head_bbox, confidence, is_valid) tuples, one per subframe
+    """
+    if not subframes:
+        return []
+
+    detector = get_pose_head_detector()
+
+    return [
+        (head_bbox, confidence, head_bbox is not None and confidence >= confidence_threshold)
+        for head_bbox, confidence in detector.detect_heads_batched(subframes, is_rgb=is_rgb)
+    ]
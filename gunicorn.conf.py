@@ -0,0 +1,29 @@
+"""
+Gunicorn configuration for the detection API.
+
+Each worker process loads its own detector and runs one batch worker
+thread (see detector.BatchScheduler). Request threads inside a worker
+decode and preprocess images in parallel and enqueue them into that
+shared batcher, so a few processes with many threads keep the model busy
+without loading one copy of it per concurrent request.
+
+Settings can be overridden through environment variables.
+"""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+
+# Threaded workers: inference runs on a real thread (gevent/eventlet would
+# block their event loop during GPU/CPU inference)
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Keep worker heartbeat files in memory instead of on disk
+worker_tmp_dir = '/dev/shm'
+
+# The detector and its batch thread are created at import time; they must be
+# created inside each worker, not in the master before fork
+preload_app = False